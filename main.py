@@ -1,49 +1,96 @@
+import hashlib
+import io
 import json
 import os
-from typing import List, Dict, Any, Optional
-import pandas as pd
-import openpyxl
-from openpyxl import load_workbook
-from google import genai
-from google.genai import types
-import base64
-from io import BytesIO
-from flask import Flask, request, jsonify, render_template_string
+import re
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, timedelta
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import TYPE_CHECKING, List, Dict, Any, Iterator, Optional
+import diskcache
+from flask import Flask, Response, request, jsonify, stream_with_context
 import logging
 
+# Heavy libraries are imported where they are used to keep cold starts fast
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # Reject oversized uploads before parsing
 
 # [Copy the entire app.py content here - all classes and routes]
 
 class ExcelProcessor:
     """Efficient Excel file processor optimized for LLM token usage"""
     
+    _NUMERIC_RE = re.compile(r'^-?\d+(?:\.\d+)?$')
+    _CELL_REF_RE = re.compile(r'^([A-Z]+)')
+    
+    # SpreadsheetML tags used by the streaming reader for oversized sheets
+    _NS = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+    _ROW_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row'
+    _SI_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}si'
+    _T_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t'
+    _REL_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+    
+    # Built-in date/time number formats and the tokens that mark a custom one as a date
+    _DATE_FORMAT_IDS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59))
+    _DATE_TOKEN_RE = re.compile(r'[dmyhs]', re.IGNORECASE)
+    _FORMAT_LITERAL_RE = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+    
     def __init__(self):
         self.max_rows_per_sheet = 100  # Limit rows to control token usage
         self.max_chars_per_cell = 500  # Limit cell content length
+        self.max_sheet_xml_bytes = 50_000_000  # Stream sheets larger than this (uncompressed)
+        
+    def cache_key(self, content_hash: str) -> str:
+        """Cache key for parsed file data - the limits change the result, so they are part of it"""
+        return f"{content_hash}:{self.max_rows_per_sheet}:{self.max_chars_per_cell}"
         
     def read_excel_file(self, file_path: str, file_name: str) -> Dict[str, Any]:
         """Read Excel file and extract structured data"""
+        import pandas as pd
+        
         try:
-            # Load workbook
-            workbook = load_workbook(file_path, data_only=True)
+            # Check the zip central directory for sheets too large to parse in full
+            large_sheets = self._find_large_sheets(file_path)
             
-            file_data = {
-                'file_name': file_name,
-                'sheets': {},
-                'summary': {
-                    'total_sheets': len(workbook.sheetnames),
-                    'sheet_names': workbook.sheetnames
+            # Load workbook with the Rust calamine engine - only cell values are needed
+            with pd.ExcelFile(file_path, engine="calamine") as workbook:
+                file_data = {
+                    'file_name': file_name,
+                    'sheets': {},
+                    'summary': {
+                        'total_sheets': len(workbook.sheet_names),
+                        'sheet_names': workbook.sheet_names
+                    }
                 }
-            }
-            
-            for sheet_name in workbook.sheetnames:
-                sheet_data = self._process_sheet(workbook[sheet_name], sheet_name)
-                file_data['sheets'][sheet_name] = sheet_data
+                
+                for sheet_name in workbook.sheet_names:
+                    if sheet_name in large_sheets:
+                        df = self._stream_large_sheet(file_path, large_sheets[sheet_name])
+                    else:
+                        # nrows caps the data rows at the parser level (header is read separately)
+                        df = pd.read_excel(
+                            workbook,
+                            sheet_name=sheet_name,
+                            nrows=self.max_rows_per_sheet,
+                            dtype=str,
+                            na_filter=False,
+                        )
+                    sheet_data = self._process_sheet(df, sheet_name)
+                    file_data['sheets'][sheet_name] = sheet_data
                 
             return file_data
             
@@ -51,126 +98,412 @@ class ExcelProcessor:
             logger.error(f"Error reading Excel file {file_name}: {str(e)}")
             return {'error': f"Failed to read {file_name}: {str(e)}"}
     
-    def _process_sheet(self, sheet, sheet_name: str) -> Dict[str, Any]:
+    def _find_large_sheets(self, file_path: str) -> Dict[str, str]:
+        """Map sheet names to worksheet XML paths whose uncompressed size exceeds the streaming threshold"""
+        if not zipfile.is_zipfile(file_path):
+            return {}  # Legacy .xls (OLE2) files have no zip central directory
+        
+        with zipfile.ZipFile(file_path) as archive:
+            sizes = {info.filename: info.file_size for info in archive.infolist()}
+            if not any(
+                name.startswith('xl/worksheets/') and size > self.max_sheet_xml_bytes
+                for name, size in sizes.items()
+            ):
+                return {}
+            
+            workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+            rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        
+        targets = {rel.get('Id'): rel.get('Target', '') for rel in rels}
+        large_sheets = {}
+        for sheet in workbook.iterfind('m:sheets/m:sheet', self._NS):
+            target = targets.get(sheet.get(self._REL_ID), '')
+            sheet_path = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+            if sizes.get(sheet_path, 0) > self.max_sheet_xml_bytes:
+                large_sheets[sheet.get('name')] = sheet_path
+        
+        return large_sheets
+    
+    @staticmethod
+    def _column_index(cell_ref: str) -> int:
+        """Convert a cell reference like 'AB12' to a zero-based column index"""
+        index = 0
+        for letter in ExcelProcessor._CELL_REF_RE.match(cell_ref).group(1):
+            index = index * 26 + ord(letter) - ord('A') + 1
+        return index - 1
+    
+    def _read_date_styles(self, archive: zipfile.ZipFile) -> tuple:
+        """Return the cell style indexes that format numbers as dates, and whether the 1904 date system is used"""
+        workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+        workbook_pr = workbook.find('m:workbookPr', self._NS)
+        date1904 = workbook_pr is not None and workbook_pr.get('date1904', '').lower() in ('1', 'true')
+        
+        if 'xl/styles.xml' not in archive.namelist():
+            return set(), date1904
+        
+        styles = ET.fromstring(archive.read('xl/styles.xml'))
+        date_formats = set(self._DATE_FORMAT_IDS)
+        for num_fmt in styles.iterfind('m:numFmts/m:numFmt', self._NS):
+            format_code = self._FORMAT_LITERAL_RE.sub('', num_fmt.get('formatCode', ''))
+            if self._DATE_TOKEN_RE.search(format_code):
+                date_formats.add(int(num_fmt.get('numFmtId')))
+        
+        date_styles = {
+            index for index, xf in enumerate(styles.iterfind('m:cellXfs/m:xf', self._NS))
+            if int(xf.get('numFmtId', 0)) in date_formats
+        }
+        return date_styles, date1904
+    
+    @staticmethod
+    def _serial_to_str(value: str, date1904: bool) -> str:
+        """Convert an Excel date serial to the string the calamine engine produces"""
+        serial = float(value)
+        offset = timedelta(milliseconds=round(serial * 86_400_000))
+        if 0 <= serial < 1:
+            return str((datetime.min + offset).time())  # Time-only cell
+        base = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+        return str(base + offset)
+    
+    @staticmethod
+    def _number_to_str(value: str) -> str:
+        """Normalise a stored number ('1E-3', '1.2e+19') the way the pandas calamine reader does"""
+        number = float(value)
+        return str(int(number)) if number.is_integer() else str(number)
+    
+    def _stream_large_sheet(self, file_path: str, sheet_path: str) -> 'pd.DataFrame':
+        """Read only the first rows of an oversized worksheet with iterparse"""
+        import pandas as pd
+        
+        rows = {}  # Zero-based row index -> {column index: value}; blank rows are absent
+        shared_refs = set()
+        
+        with zipfile.ZipFile(file_path) as archive:
+            date_styles, date1904 = self._read_date_styles(archive)
+            
+            with archive.open(sheet_path) as sheet_xml:
+                next_index = 0
+                for _, elem in ET.iterparse(sheet_xml):
+                    if elem.tag != self._ROW_TAG:
+                        continue
+                    
+                    # Honour the row number so leading blank rows keep the header on row 1
+                    index = int(elem.get('r')) - 1 if elem.get('r') else next_index
+                    next_index = index + 1
+                    if index > self.max_rows_per_sheet:  # Header + max_rows_per_sheet rows
+                        break
+                    
+                    row = {}
+                    for cell in elem.iterfind('m:c', self._NS):
+                        col = self._column_index(cell.get('r')) if cell.get('r') else len(row)
+                        cell_type = cell.get('t')
+                        if cell_type == 'inlineStr':
+                            row[col] = ''.join(t.text or '' for t in cell.iter(self._T_TAG))
+                            continue
+                        
+                        value = cell.findtext('m:v', '', self._NS)
+                        if cell_type == 's' and value:
+                            shared_refs.add(int(value))
+                            row[col] = int(value)  # Resolved once shared strings are read
+                        elif cell_type == 'b':
+                            row[col] = 'True' if value == '1' else 'False'
+                        elif cell_type in (None, 'n') and value and int(cell.get('s', 0)) in date_styles:
+                            row[col] = self._serial_to_str(value, date1904)
+                        elif cell_type in (None, 'n') and value:
+                            row[col] = self._number_to_str(value)
+                        else:
+                            row[col] = value
+                    
+                    if row:
+                        rows[index] = row
+                    elem.clear()
+            
+            shared_strings = self._read_shared_strings(archive, shared_refs)
+        
+        n_rows = max(rows, default=-1) + 1
+        n_cols = max((max(row) + 1 for row in rows.values()), default=0)
+        table = [
+            [
+                shared_strings.get(value, '') if isinstance(value, int) else value
+                for value in (rows.get(index, {}).get(col, '') for col in range(n_cols))
+            ]
+            for index in range(n_rows)
+        ]
+        
+        header_row = table[0] if table else []
+        headers = [header or f"Column_{col}" for col, header in enumerate(header_row, 1)]
+        return pd.DataFrame(table[1:], columns=headers, dtype=str)
+    
+    def _read_shared_strings(self, archive: zipfile.ZipFile, needed: set) -> Dict[int, str]:
+        """Read only the shared strings referenced by the streamed rows"""
+        if not needed or 'xl/sharedStrings.xml' not in archive.namelist():
+            return {}
+        
+        last_needed = max(needed)
+        shared_strings = {}
+        with archive.open('xl/sharedStrings.xml') as strings_xml:
+            index = 0
+            for _, elem in ET.iterparse(strings_xml):
+                if elem.tag != self._SI_TAG:
+                    continue
+                if index in needed:
+                    shared_strings[index] = ''.join(t.text or '' for t in elem.iter(self._T_TAG))
+                elem.clear()
+                index += 1
+                if index > last_needed:
+                    break
+        
+        return shared_strings
+    
+    @staticmethod
+    def _unique_headers(headers: List[str]) -> List[str]:
+        """Suffix repeated header names with .1, .2, ... the way pandas does, so no column is lost"""
+        seen = set()
+        unique = []
+        for header in headers:
+            name, count = header, 0
+            while name in seen:
+                count += 1
+                name = f"{header}.{count}"
+            seen.add(name)
+            unique.append(name)
+        return unique
+    
+    def _process_sheet(self, df: 'pd.DataFrame', sheet_name: str) -> Dict[str, Any]:
         """Process individual sheet with optimization for LLM"""
         try:
-            # Get sheet dimensions
-            max_row = min(sheet.max_row, self.max_rows_per_sheet + 1)  # +1 for header
-            max_col = sheet.max_column
+            # Extract headers (first row), naming blank header cells by position
+            headers = [
+                f"Column_{col}" if str(header).startswith("Unnamed:") else str(header)
+                for col, header in enumerate(df.columns, 1)
+            ]
+            headers = self._unique_headers(headers)
+            df.columns = headers
             
-            # Extract headers (first row)
-            headers = []
-            for col in range(1, max_col + 1):
-                cell_value = sheet.cell(row=1, column=col).value
-                headers.append(str(cell_value) if cell_value is not None else f"Column_{col}")
+            # Drop rows without any data
+            df = df[df.ne("").any(axis=1)]
             
-            # Extract data rows
-            data_rows = []
-            for row in range(2, max_row + 1):
-                row_data = {}
-                has_data = False
-                
-                for col, header in enumerate(headers, 1):
-                    cell_value = sheet.cell(row=row, column=col).value
-                    
-                    # Clean and limit cell content
-                    if cell_value is not None:
-                        cell_str = str(cell_value)
-                        if len(cell_str) > self.max_chars_per_cell:
-                            cell_str = cell_str[:self.max_chars_per_cell] + "..."
-                        row_data[header] = cell_str
-                        has_data = True
-                    else:
-                        row_data[header] = ""
-                
-                if has_data:
-                    data_rows.append(row_data)
+            # Clean and limit cell content
+            limit = self.max_chars_per_cell
+            df = df.apply(lambda s: s.where(s.str.len() <= limit, s.str.slice(0, limit) + "..."))
+            
+            # Columnar layout: each header is stored once alongside its values
+            columns = df.to_dict(orient="list")
+            n_rows = len(df)
             
             # Create summary statistics
             summary = {
-                'total_rows': len(data_rows),
+                'total_rows': n_rows,
                 'total_columns': len(headers),
                 'headers': headers,
-                'data_types': self._analyze_data_types(data_rows, headers),
-                'sample_data': data_rows[:3] if data_rows else []  # First 3 rows as sample
+                'data_types': self._analyze_data_types(columns)
             }
             
             return {
                 'sheet_name': sheet_name,
                 'summary': summary,
-                'data': data_rows
+                'data': {
+                    'columns': columns,
+                    'n_rows': n_rows
+                }
             }
             
         except Exception as e:
             logger.error(f"Error processing sheet {sheet_name}: {str(e)}")
             return {'error': f"Failed to process sheet {sheet_name}: {str(e)}"}
     
-    def _analyze_data_types(self, data_rows: List[Dict], headers: List[str]) -> Dict[str, str]:
-        """Analyze data types for each column"""
-        data_types = {}
-        
-        for header in headers:
-            sample_values = [row.get(header, "") for row in data_rows[:10] if row.get(header, "")]
-            
-            if not sample_values:
-                data_types[header] = "empty"
-                continue
-                
-            # Simple type detection
-            numeric_count = sum(1 for val in sample_values if str(val).replace('.', '').replace('-', '').isdigit())
-            
-            if numeric_count > len(sample_values) * 0.7:
-                data_types[header] = "numeric"
-            else:
-                data_types[header] = "text"
-                
-        return data_types
+    def _analyze_data_types(self, columns: Dict[str, List[str]]) -> Dict[str, str]:
+        """Analyze data types for each column from the non-empty values among its first 10 cells"""
+        samples = {header: [val for val in islice(values, 10) if val] for header, values in columns.items()}
+        return {
+            header: (
+                "empty" if not sample_values
+                else "numeric" if sum(self._NUMERIC_RE.match(val) is not None for val in sample_values) > len(sample_values) * 0.7
+                else "text"
+            )
+            for header, sample_values in samples.items()
+        }
+    
+    # Decoder key sent once so the LLM can parse the compact format below
+    SUMMARY_KEY = (
+        "FORMAT: [FILE:name|SHEETS:count] then per sheet "
+        "[SHEET:name|R:rows|C:columns|COLS:names|T:types][SAMPLE:first row values]; "
+        "lists are ','-separated, sample values ';'-separated, '...' = truncated, "
+        "T: num=numeric text=text empty=no values; [ERR:...] = unreadable"
+    )
+    TYPE_CODES = {'numeric': 'num', 'text': 'text', 'empty': 'empty'}
+    # Delimiters of the compact format, mapped to neutral characters inside field values.
+    # SAMPLE values are ';'-separated, so commas there are kept.
+    _FIELD_ESCAPES = str.maketrans({
+        ';': ' ', ',': ' ', '|': '/', '[': '(', ']': ')', '\n': ' ', '\r': ' '
+    })
+    _SAMPLE_ESCAPES = str.maketrans({
+        ';': ',', '|': '/', '[': '(', ']': ')', '\n': ' ', '\r': ' '
+    })
+    
+    @staticmethod
+    def _escape_field(value: str) -> str:
+        """Strip characters that would break a tagged field or list in the summary"""
+        return str(value).translate(ExcelProcessor._FIELD_ESCAPES)
+    
+    @staticmethod
+    def _preview_value(value: str, limit: int = 50) -> str:
+        """Shorten a cell value and strip characters that would break the sample fragment"""
+        value = str(value).translate(ExcelProcessor._SAMPLE_ESCAPES)
+        return value[:limit] + ("..." if len(value) > limit else "")
     
     def create_llm_optimized_summary(self, files_data: List[Dict[str, Any]]) -> str:
         """Create a token-efficient summary for LLM"""
-        summary_parts = []
-        
-        summary_parts.append("=== EXCEL FILES ANALYSIS SUMMARY ===")
-        summary_parts.append(f"Total files processed: {len(files_data)}")
+        buf = io.StringIO()
+        w = buf.write
+        w(self.SUMMARY_KEY)
+        w(f"\nFILES:{len(files_data)}")
         
         for file_data in files_data:
             if 'error' in file_data:
-                summary_parts.append(f"\n❌ {file_data.get('file_name', 'Unknown')}: {file_data['error']}")
+                error = self._escape_field(file_data['error'])
+                w(f"\n[ERR:{self._escape_field(file_data.get('file_name', 'Unknown'))}|{error}]")
                 continue
                 
-            file_name = file_data['file_name']
-            summary_parts.append(f"\n📁 FILE: {file_name}")
-            summary_parts.append(f"   Sheets: {file_data['summary']['total_sheets']} ({', '.join(file_data['summary']['sheet_names'])})")
+            file_name = self._escape_field(file_data['file_name'])
+            w(f"\n[FILE:{file_name}|SHEETS:{file_data['summary']['total_sheets']}]")
             
             for sheet_name, sheet_data in file_data['sheets'].items():
                 if 'error' in sheet_data:
-                    summary_parts.append(f"   ❌ Sheet '{sheet_name}': {sheet_data['error']}")
+                    w(f"\n[ERR:{self._escape_field(sheet_name)}|{self._escape_field(sheet_data['error'])}]")
                     continue
                     
                 summary = sheet_data['summary']
-                summary_parts.append(f"\n   📊 SHEET: {sheet_name}")
-                summary_parts.append(f"      Dimensions: {summary['total_rows']} rows × {summary['total_columns']} columns")
-                summary_parts.append(f"      Columns: {', '.join(summary['headers'][:10])}{'...' if len(summary['headers']) > 10 else ''}")
+                headers = summary['headers'][:10]
+                more = '...' if len(summary['headers']) > 10 else ''
+                types = ','.join(self.TYPE_CODES[summary['data_types'][h]] for h in headers)
+                cols = ','.join(self._escape_field(h) for h in headers)
+                w(
+                    f"\n[SHEET:{self._escape_field(sheet_name)}|R:{summary['total_rows']}|C:{summary['total_columns']}"
+                    f"|COLS:{cols}{more}|T:{types}{more}]"
+                )
                 
-                # Add sample data
-                if summary['sample_data']:
-                    summary_parts.append("      Sample data:")
-                    for i, row in enumerate(summary['sample_data'][:2], 1):
-                        row_preview = {k: str(v)[:50] + ("..." if len(str(v)) > 50 else "") for k, v in row.items()}
-                        summary_parts.append(f"        Row {i}: {json.dumps(row_preview, ensure_ascii=False)}")
-        
-        return "\n".join(summary_parts)
+                # Add one sample row as a delimited fragment, rebuilt from the columns we emit
+                if sheet_data['data']['n_rows']:
+                    columns = sheet_data['data']['columns']
+                    values = ';'.join(self._preview_value(columns[h][0]) for h in headers)
+                    w(f"[SAMPLE:{values}{more}]")
+        
+        return buf.getvalue()
+
+class ResponseCache:
+    """Two-tier cache for LLM responses: exact (summary, query) hash, then semantic query match"""
+    
+    def __init__(self, maxsize: int = 256, directory: str = "/tmp/gemini_cache", similarity_threshold: float = 0.85):
+        self.maxsize = maxsize
+        self.similarity_threshold = similarity_threshold
+        self._memory = OrderedDict()  # In-process LRU tier
+        self._disk = diskcache.Cache(directory)  # Survives process restarts
+        self._embeddings = {}  # cache key -> (summary hash, query embedding), pruned with the LRU tier
+        self._encoder = None
+        self._encoder_loaded = False
+        self._lock = threading.Lock()
+        self._encoder_lock = threading.Lock()  # Model loading is slow; keep it off the cache lock
+    
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    
+    def make_key(self, excel_summary: str, user_query: str) -> str:
+        return self._hash(excel_summary + "\x00" + user_query)
+    
+    def _embed(self, user_query: str) -> Optional['np.ndarray']:
+        """Embed a query for the semantic tier (only if sentence-transformers is installed)"""
+        with self._encoder_lock:
+            if not self._encoder_loaded:
+                self._encoder_loaded = True
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    self._encoder = SentenceTransformer("all-MiniLM-L6-v2")
+                except ImportError:
+                    logger.info("sentence-transformers not installed, semantic cache disabled")
+        
+        if self._encoder is None or not user_query:
+            return None
+        return self._encoder.encode(user_query, normalize_embeddings=True)
+    
+    def _get_exact(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        
+        response = self._disk.get(key)
+        if response is not None:
+            self._remember(key, response)
+        return response
+    
+    def _remember(self, key: str, response: str, summary_hash: Optional[str] = None, embedding=None):
+        with self._lock:
+            self._memory[key] = response
+            self._memory.move_to_end(key)
+            if embedding is not None:
+                self._embeddings[key] = (summary_hash, embedding)
+            while len(self._memory) > self.maxsize:
+                evicted, _ = self._memory.popitem(last=False)
+                self._embeddings.pop(evicted, None)
+    
+    def lookup(self, excel_summary: str, user_query: str) -> tuple:
+        """Return (cached response or None, query embedding or None) for this summary and query
+        
+        Pass the embedding back to set() on a miss so the query is not embedded twice.
+        """
+        response = self._get_exact(self.make_key(excel_summary, user_query))
+        if response is not None:
+            return response, None
+        
+        # Semantic tier: same data, similarly phrased question
+        embedding = self._embed(user_query)
+        if embedding is None:
+            return None, None
+        
+        summary_hash = self._hash(excel_summary)
+        with self._lock:
+            candidates = [
+                (candidate, key) for key, (candidate_hash, candidate) in self._embeddings.items()
+                if candidate_hash == summary_hash
+            ]
+        for candidate, key in candidates:
+            if float(embedding @ candidate) >= self.similarity_threshold:
+                response = self._get_exact(key)
+                if response is not None:
+                    return response, embedding
+        return None, embedding
+    
+    def set(self, excel_summary: str, user_query: str, response: str, embedding=None):
+        """Store a successful response, with the query embedding from lookup() if there is one"""
+        key = self.make_key(excel_summary, user_query)
+        self._remember(key, response, self._hash(excel_summary), embedding)
+        self._disk.set(key, response)
 
 class GeminiLLM:
     """Gemini LLM integration"""
     
     def __init__(self, api_key: str):
+        from google import genai
+        
         self.client = genai.Client(api_key=api_key)
         self.model = "gemini-2.0-flash"
     
-    def analyze_excel_data(self, excel_summary: str, user_query: str = "") -> str:
-        """Send Excel data to Gemini for analysis"""
+    def stream_excel_analysis(self, excel_summary: str, user_query: str = "") -> Iterator[str]:
+        """Send Excel data to Gemini for analysis, yielding text as it is generated
+        
+        API errors are logged and re-raised so the caller can report them separately
+        from the analysis text.
+        """
+        cached, query_embedding = response_cache.lookup(excel_summary, user_query)
+        if cached is not None:
+            logger.info("Serving Gemini analysis from cache")
+            yield cached
+            return
+        
         try:
+            from google.genai import types
+            
             prompt = f"""
 You are an expert data analyst. I have processed multiple Excel files and need your analysis.
 
@@ -200,230 +533,103 @@ Be specific and actionable in your response.
             
             generate_content_config = types.GenerateContentConfig(tools=tools)
             
-            response_text = ""
+            response_parts = []
             for chunk in self.client.models.generate_content_stream(
                 model=self.model,
                 contents=contents,
                 config=generate_content_config,
             ):
-                response_text += chunk.text
-                
-            return response_text
+                if chunk.text:
+                    response_parts.append(chunk.text)
+                    yield chunk.text
+            
+            # Only successful responses are cached
+            response_cache.set(excel_summary, user_query, "".join(response_parts), query_embedding)
             
         except Exception as e:
             logger.error(f"Error calling Gemini API: {str(e)}")
-            return f"Error analyzing data with Gemini: {str(e)}"
+            raise
+
+def _parse_one(args: tuple) -> Dict[str, Any]:
+    """Parse a single Excel file in a worker process"""
+    file_path, file_name = args
+    return ExcelProcessor().read_excel_file(file_path, file_name)
+
+def _init_parse_worker():
+    """Load pandas once per worker process instead of inside the first parse"""
+    import pandas  # noqa: F401
+
+# Long-lived worker pool for multi-file uploads, created on first use
+_parse_pool = None
+_parse_pool_unavailable = False
+_parse_pool_lock = threading.Lock()
+
+def _get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """Return the shared parse pool, or None where multiprocessing is unavailable (e.g. AWS Lambda has no /dev/shm)"""
+    global _parse_pool, _parse_pool_unavailable
+    with _parse_pool_lock:
+        if _parse_pool is None and not _parse_pool_unavailable:
+            try:
+                _parse_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, initializer=_init_parse_worker)
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"Process pool unavailable, parsing serially: {str(e)}")
+                _parse_pool_unavailable = True
+        return _parse_pool
+
+def parse_files(jobs: List[tuple]) -> List[Dict[str, Any]]:
+    """Parse (file_path, file_name) jobs, in parallel only when there are several files"""
+    global _parse_pool
+    pool = _get_parse_pool() if len(jobs) > 1 else None
+    if pool is not None:
+        try:
+            return list(pool.map(_parse_one, jobs))
+        except BrokenProcessPool as e:
+            logger.warning(f"Process pool broke, parsing serially: {str(e)}")
+            with _parse_pool_lock:
+                if _parse_pool is pool:
+                    _parse_pool = None
+            # Release the broken pool's management thread and queues
+            pool.shutdown(wait=False, cancel_futures=True)
+    return [_parse_one(job) for job in jobs]
 
 # Global instances
 excel_processor = ExcelProcessor()
-gemini_llm = None
-
-# HTML Template
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Excel to LLM Processor</title>
-    <style>
-        body { font-family: Arial, sans-serif; max-width: 1200px; margin: 0 auto; padding: 20px; }
-        .container { background: #f5f5f5; padding: 20px; border-radius: 8px; margin-bottom: 20px; }
-        .upload-area { border: 2px dashed #ccc; padding: 40px; text-align: center; border-radius: 8px; }
-        .upload-area.dragover { border-color: #007bff; background: #e3f2fd; }
-        button { background: #007bff; color: white; padding: 12px 24px; border: none; border-radius: 4px; cursor: pointer; margin: 5px; }
-        button:hover { background: #0056b3; }
-        button:disabled { background: #6c757d; cursor: not-allowed; }
-        .file-list { margin: 20px 0; }
-        .file-item { background: white; padding: 10px; margin: 5px 0; border-radius: 4px; border-left: 4px solid #007bff; }
-        .result { background: white; padding: 20px; border-radius: 8px; margin-top: 20px; }
-        .loading { text-align: center; padding: 20px; }
-        .error { color: #dc3545; }
-        .success { color: #28a745; }
-        textarea { width: 100%; min-height: 100px; padding: 10px; border-radius: 4px; border: 1px solid #ddd; }
-        pre { background: #f8f9fa; padding: 15px; border-radius: 4px; overflow-x: auto; white-space: pre-wrap; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>📊 Excel to LLM Processor</h1>
-        <p>Upload multiple Excel files to analyze with AI. Optimized for efficient token usage.</p>
-    </div>
-
-    <div class="container">
-        <h2>🔑 Gemini API Key</h2>
-        <input type="text" id="apiKey" placeholder="Enter your Gemini API key" style="width: 100%; padding: 10px; margin-bottom: 10px;">
-        <button onclick="setApiKey()">Set API Key</button>
-        <div id="apiKeyStatus"></div>
-    </div>
-
-    <div class="container">
-        <h2>📁 Upload Excel Files</h2>
-        <div class="upload-area" id="uploadArea">
-            <p>Drag & drop Excel files here or click to select</p>
-            <input type="file" id="fileInput" multiple accept=".xlsx,.xls" style="display: none;">
-            <button onclick="document.getElementById('fileInput').click()">Select Files</button>
-        </div>
-        <div class="file-list" id="fileList"></div>
-    </div>
-
-    <div class="container">
-        <h2>❓ Your Question (Optional)</h2>
-        <textarea id="userQuery" placeholder="Ask a specific question about your Excel data, or leave blank for general analysis..."></textarea>
-    </div>
-
-    <div class="container">
-        <button id="processBtn" onclick="processFiles()" disabled>🚀 Process & Analyze</button>
-        <button onclick="clearAll()">🗑️ Clear All</button>
-    </div>
-
-    <div id="results"></div>
-
-    <script>
-        let selectedFiles = [];
-        let apiKey = '';
-
-        // API Key management
-        function setApiKey() {
-            const key = document.getElementById('apiKey').value.trim();
-            if (key) {
-                apiKey = key;
-                document.getElementById('apiKeyStatus').innerHTML = '<span class="success">✅ API Key set successfully</span>';
-                updateProcessButton();
-            } else {
-                document.getElementById('apiKeyStatus').innerHTML = '<span class="error">❌ Please enter a valid API key</span>';
-            }
-        }
-
-        // File upload handling
-        const uploadArea = document.getElementById('uploadArea');
-        const fileInput = document.getElementById('fileInput');
-
-        uploadArea.addEventListener('click', () => fileInput.click());
-        uploadArea.addEventListener('dragover', (e) => {
-            e.preventDefault();
-            uploadArea.classList.add('dragover');
-        });
-        uploadArea.addEventListener('dragleave', () => {
-            uploadArea.classList.remove('dragover');
-        });
-        uploadArea.addEventListener('drop', (e) => {
-            e.preventDefault();
-            uploadArea.classList.remove('dragover');
-            handleFiles(e.dataTransfer.files);
-        });
-
-        fileInput.addEventListener('change', (e) => {
-            handleFiles(e.target.files);
-        });
-
-        function handleFiles(files) {
-            for (let file of files) {
-                if (file.name.endsWith('.xlsx') || file.name.endsWith('.xls')) {
-                    selectedFiles.push(file);
-                }
-            }
-            displayFileList();
-            updateProcessButton();
-        }
-
-        function displayFileList() {
-            const fileList = document.getElementById('fileList');
-            if (selectedFiles.length === 0) {
-                fileList.innerHTML = '';
-                return;
-            }
-
-            fileList.innerHTML = '<h3>Selected Files:</h3>' + 
-                selectedFiles.map((file, index) => 
-                    `<div class="file-item">
-                        📄 ${file.name} (${(file.size / 1024 / 1024).toFixed(2)} MB)
-                        <button onclick="removeFile(${index})" style="float: right; background: #dc3545;">Remove</button>
-                    </div>`
-                ).join('');
-        }
-
-        function removeFile(index) {
-            selectedFiles.splice(index, 1);
-            displayFileList();
-            updateProcessButton();
-        }
-
-        function updateProcessButton() {
-            const processBtn = document.getElementById('processBtn');
-            processBtn.disabled = !(selectedFiles.length > 0 && apiKey);
-        }
-
-        function clearAll() {
-            selectedFiles = [];
-            document.getElementById('fileList').innerHTML = '';
-            document.getElementById('results').innerHTML = '';
-            document.getElementById('userQuery').value = '';
-            updateProcessButton();
-        }
-
-        async function processFiles() {
-            if (selectedFiles.length === 0 || !apiKey) return;
-
-            const results = document.getElementById('results');
-            results.innerHTML = '<div class="loading">🔄 Processing files and analyzing with AI...</div>';
-
-            const formData = new FormData();
-            formData.append('api_key', apiKey);
-            formData.append('user_query', document.getElementById('userQuery').value);
-            
-            selectedFiles.forEach(file => {
-                formData.append('files', file);
-            });
-
-            try {
-                const response = await fetch('/api/process', {
-                    method: 'POST',
-                    body: formData
-                });
-
-                const data = await response.json();
-
-                if (data.success) {
-                    results.innerHTML = `
-                        <div class="result">
-                            <h2>✅ Processing Complete</h2>
-                            <h3>📊 Data Summary:</h3>
-                            <pre>${data.excel_summary}</pre>
-                            <h3>🤖 AI Analysis:</h3>
-                            <pre>${data.llm_analysis}</pre>
-                        </div>
-                    `;
-                } else {
-                    results.innerHTML = `
-                        <div class="result">
-                            <h2 class="error">❌ Processing Failed</h2>
-                            <p>${data.error}</p>
-                        </div>
-                    `;
-                }
-            } catch (error) {
-                results.innerHTML = `
-                    <div class="result">
-                        <h2 class="error">❌ Network Error</h2>
-                        <p>Failed to process files: ${error.message}</p>
-                    </div>
-                `;
-            }
-        }
-    </script>
-</body>
-</html>
-"""
+response_cache = ResponseCache()
+parse_cache = diskcache.Cache("/tmp/xlsx_cache", size_limit=2**30)  # Parsed files by content hash
+
+# Gemini clients reused across requests, keyed by API key hash (LRU-bounded)
+_CLIENT_CACHE_SIZE = 32
+_client_cache = OrderedDict()
+_client_cache_lock = threading.Lock()
+
+def get_gemini_llm(api_key: str) -> 'GeminiLLM':
+    """Return a cached GeminiLLM for this API key, creating it if needed"""
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    with _client_cache_lock:
+        client = _client_cache.get(key_hash)
+        if client is None:
+            client = GeminiLLM(api_key)
+            _client_cache[key_hash] = client
+            while len(_client_cache) > _CLIENT_CACHE_SIZE:
+                _client_cache.popitem(last=False)
+        _client_cache.move_to_end(key_hash)
+        return client
+
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x1f\x7f]')
+
+def display_name(filename: str) -> str:
+    """Label for an uploaded file in the summary - never used as a filesystem path"""
+    return _CONTROL_CHARS_RE.sub('', os.path.basename(filename.replace('\\', '/'))).strip()
 
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # The page has no template variables, so serve it as a static file
+    response = app.send_static_file('index.html')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
 
 @app.route('/api/process', methods=['POST'])
 def process_excel_files():
-    global gemini_llm
-    
     try:
         # Get API key and user query
         api_key = request.form.get('api_key')
@@ -432,48 +638,77 @@ def process_excel_files():
         if not api_key:
             return jsonify({'success': False, 'error': 'API key is required'})
         
-        # Initialize Gemini LLM
-        gemini_llm = GeminiLLM(api_key)
+        # Reuse the Gemini client (and its connection pool) for this API key
+        gemini_llm = get_gemini_llm(api_key)
         
         # Get uploaded files
         files = request.files.getlist('files')
         if not files:
             return jsonify({'success': False, 'error': 'No files uploaded'})
         
-        # Process each Excel file
+        # Save each Excel file
         files_data = []
         temp_files = []
+        to_parse = []  # (index in files_data, temp path, file name, content digest) for cache misses
         
-        for file in files:
-            if file and file.filename.endswith(('.xlsx', '.xls')):
-                # Save temporary file
-                temp_path = f"/tmp/{file.filename}"
-                file.save(temp_path)
-                temp_files.append(temp_path)
-                
-                # Process Excel file
-                file_data = excel_processor.read_excel_file(temp_path, file.filename)
-                files_data.append(file_data)
+        try:
+            for file in files:
+                # calamine reads both .xlsx and legacy .xls; anything else is skipped up front
+                suffix = os.path.splitext(file.filename or '')[1].lower()
+                if file and suffix in ('.xlsx', '.xls'):
+                    file_name = display_name(file.filename) or f"upload{suffix}"
+                    
+                    # Stream upload to a unique temporary file (never trust the client filename),
+                    # hashing the content on the way through
+                    content_hash = hashlib.blake2b(digest_size=16)
+                    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False, dir="/tmp") as temp_file:
+                        temp_files.append(temp_file.name)
+                        while chunk := file.stream.read(1 << 20):
+                            content_hash.update(chunk)
+                            temp_file.write(chunk)
+                    
+                    # Identical uploads skip parsing entirely
+                    cached = parse_cache.get(excel_processor.cache_key(content_hash.hexdigest()))
+                    if cached is not None:
+                        files_data.append(dict(cached, file_name=file_name))
+                    else:
+                        files_data.append(None)
+                        to_parse.append((len(files_data) - 1, temp_file.name, file_name, content_hash.hexdigest()))
+            
+            # Process Excel files - each file is parsed independently
+            if to_parse:
+                parsed = parse_files([(path, name) for _, path, name, _ in to_parse])
+                for (index, _, _, digest), file_data in zip(to_parse, parsed):
+                    files_data[index] = file_data
+                    if 'error' not in file_data:
+                        parse_cache.set(excel_processor.cache_key(digest), file_data, expire=3600)
+        finally:
+            # Clean up temporary files
+            for temp_path in temp_files:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
         
         # Create LLM-optimized summary
         excel_summary = excel_processor.create_llm_optimized_summary(files_data)
         
-        # Get AI analysis
-        llm_analysis = gemini_llm.analyze_excel_data(excel_summary, user_query)
-        
-        # Clean up temporary files
-        for temp_file in temp_files:
+        # Stream AI analysis back as newline-delimited JSON events
+        def generate():
+            yield json.dumps({
+                'type': 'summary',
+                'excel_summary': excel_summary,
+                'files_processed': len(files_data)
+            }) + "\n"
             try:
-                os.remove(temp_file)
-            except:
-                pass
-        
-        return jsonify({
-            'success': True,
-            'excel_summary': excel_summary,
-            'llm_analysis': llm_analysis,
-            'files_processed': len(files_data)
-        })
+                for text in gemini_llm.stream_excel_analysis(excel_summary, user_query):
+                    yield json.dumps({'type': 'analysis', 'text': text}) + "\n"
+            except Exception as e:
+                yield json.dumps({'type': 'error', 'error': f"Error analyzing data with Gemini: {str(e)}"}) + "\n"
+                return
+            yield json.dumps({'type': 'done'}) + "\n"
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
         
     except Exception as e:
         logger.error(f"Error processing files: {str(e)}")
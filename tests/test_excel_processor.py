@@ -0,0 +1,86 @@
+import datetime
+import zipfile
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("python_calamine")
+openpyxl = pytest.importorskip("openpyxl")
+
+from main import ExcelProcessor
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    workbook = openpyxl.Workbook()
+
+    # Data starts at C3, leaving blank leading rows and columns
+    sheet = workbook.active
+    sheet.title = "Offset"
+    sheet["C3"], sheet["D3"], sheet["E3"] = "h", "when", "n"
+    sheet["C4"], sheet["D4"], sheet["E4"] = "a", datetime.datetime(2024, 1, 1), 1.5
+    sheet["C5"], sheet["D5"], sheet["E5"] = "b", datetime.datetime(2024, 1, 2, 12, 30, 15), 2
+    sheet["C6"], sheet["D6"], sheet["E6"] = "c", datetime.time(7, 45), -3
+    sheet["D7"] = datetime.date(2023, 12, 31)
+    sheet["D7"].number_format = "dd/mm/yyyy"
+    sheet["E7"] = 0.25
+    sheet["E7"].number_format = "0.00%"
+    sheet["F3"], sheet["F4"], sheet["F5"] = "exp", 0.001, 1.234567890123457e+19
+
+    # More rows than the per-sheet cap, with a blank row inside it
+    sheet = workbook.create_sheet("Long")
+    sheet.append(["date", "sku", None, "qty", "flag"])
+    for i in range(300):
+        if i == 10:
+            sheet.append([])
+            continue
+        sheet.append([f"2024-01-{i % 28 + 1:02d}", "ABC" * (i % 3 + 1), None, i * 1.5 if i % 2 else i, i % 2 == 0])
+
+    # Repeated headers, and a real header colliding with a generated Column_N name
+    sheet = workbook.create_sheet("Dupes")
+    sheet.append(["a", "a", "b", "Column_5", None])
+    sheet.append([1, 2, 3, 4, 5])
+
+    saved = tmp_path / "saved.xlsx"
+    workbook.save(saved)
+
+    # Store 0.001 in exponent form, as other writers do
+    path = tmp_path / "book.xlsx"
+    with zipfile.ZipFile(saved) as source, zipfile.ZipFile(path, "w") as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if item.filename == "xl/worksheets/sheet1.xml":
+                data = data.replace(b"<v>0.001</v>", b"<v>1E-3</v>")
+            target.writestr(item, data)
+    return str(path)
+
+
+def test_streaming_reader_matches_pandas_path(workbook_path):
+    processor = ExcelProcessor()
+    expected = processor.read_excel_file(workbook_path, "book.xlsx")
+    assert 'error' not in expected
+
+    processor.max_sheet_xml_bytes = 0  # Force every sheet through the streaming reader
+    assert set(processor._find_large_sheets(workbook_path)) == {"Offset", "Long", "Dupes"}
+    assert processor.read_excel_file(workbook_path, "book.xlsx") == expected
+
+
+def test_leading_blank_rows_keep_header_on_first_row(workbook_path):
+    processor = ExcelProcessor()
+    processor.max_sheet_xml_bytes = 0
+    sheet = processor.read_excel_file(workbook_path, "book.xlsx")['sheets']['Offset']
+
+    assert sheet['summary']['headers'] == ['Column_1', 'Column_2', 'Column_3', 'Column_4', 'Column_5', 'Column_6']
+    assert sheet['data']['columns']['Column_4'][:2] == ['when', '2024-01-01 00:00:00']
+    assert sheet['summary']['data_types']['Column_4'] == 'text'
+    assert sheet['data']['columns']['Column_6'][:3] == ['exp', '0.001', '12345678901234569216']
+
+
+def test_repeated_headers_keep_every_column(workbook_path):
+    processor = ExcelProcessor()
+    processor.max_sheet_xml_bytes = 0
+    sheet = processor.read_excel_file(workbook_path, "book.xlsx")['sheets']['Dupes']
+
+    assert sheet['data']['columns'] == {
+        'a': ['1'], 'a.1': ['2'], 'b': ['3'], 'Column_5': ['4'], 'Column_5.1': ['5']
+    }